@@ -1,18 +1,29 @@
 from __future__ import annotations
-import os, time, base64, re, io, logging
+import os, time, re, io, hashlib, hmac, logging, threading
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from contextlib import asynccontextmanager
 from typing import Any, List, Optional
 
+import orjson
+import pybase64
 import requests
-from fastapi import FastAPI, Depends, Header, HTTPException, status, Response
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from requests.adapters import HTTPAdapter
+from fastapi import FastAPI, BackgroundTasks, Depends, Header, HTTPException, status, Response
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import BaseModel, Field, ValidationError
 from pypdf import PdfReader
 from pdf2image import convert_from_bytes
 from PIL import Image
 import pytesseract
+from rapidfuzz import fuzz
 
 
 # ---------- SEGURIDAD ----------
+# Clave esperada, codificada una vez al arrancar
+_API_KEY = (os.getenv("API_KEY") or os.getenv("API_TOKEN") or "").encode()
+
+
 def require_api_key(
     x_api_key: Optional[str] = Header(default=None, alias="X-API-Key"),
     api_token_hdr: Optional[str] = Header(default=None, alias="API_TOKEN"),
@@ -20,12 +31,42 @@ def require_api_key(
     provided = (x_api_key or api_token_hdr)
     if not provided:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="API key header missing")
-    expected = os.getenv("API_KEY") or os.getenv("API_TOKEN")
-    if not expected or provided != expected:
+    if not _API_KEY or not hmac.compare_digest(provided.encode(), _API_KEY):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid API key")
 
 
 # ---------- CLIENTE ODOO (JSON-RPC) ----------
+# Pool compartido para lanzar en paralelo llamadas independientes a Odoo.
+# Por defecto tantos hilos como el threadpool de peticiones de AnyIO (40): con carga alta
+# las llamadas no se quedan en cola detrás de unos pocos workers. Los hilos se crean bajo demanda.
+_RPC_WORKERS = int(os.getenv("ODOO_RPC_WORKERS") or 40)
+_RPC_POOL = ThreadPoolExecutor(max_workers=_RPC_WORKERS)
+
+# Sesión HTTP compartida: reutiliza las conexiones TCP/TLS con Odoo entre llamadas.
+# Puede haber tantas llamadas a la vez como hilos de peticiones (40 en AnyIO) más los de _RPC_POOL;
+# con un pool menor urllib3 descarta las conexiones sobrantes y se vuelve a pagar el handshake.
+_HTTP_POOL_SIZE = int(os.getenv("ODOO_HTTP_POOL") or 40 + _RPC_WORKERS)
+_HTTP = requests.Session()
+_HTTP.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=_HTTP_POOL_SIZE))
+_HTTP.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=_HTTP_POOL_SIZE))
+
+# uid autenticado por (url, db, user, password); no cambia mientras vive el proceso
+_UID_CACHE: dict[tuple, int] = {}
+
+
+class OdooError(RuntimeError):
+    """
+    Error devuelto por Odoo; `name` es la excepción del servidor (p. ej. odoo.exceptions.AccessDenied)
+    y `message` el texto para el usuario, sin el traceback de data.debug.
+    """
+
+    def __init__(self, error: dict):
+        super().__init__(str(error))
+        data = (error or {}).get("data") or {}
+        self.name = data.get("name") or ""
+        self.message = data.get("message") or (error or {}).get("message") or "Error de Odoo"
+
+
 class OdooClient:
     def __init__(self):
         self.url = (os.getenv("ODOO_URL") or "").rstrip("/")
@@ -44,25 +85,54 @@ class OdooClient:
             "params": {"service": service, "method": method, "args": args, "kwargs": kwargs or {}},
             "id": int(time.time() * 1000),
         }
-        r = requests.post(self.url + "/jsonrpc", json=payload, timeout=60)
+        r = _HTTP.post(
+            self.url + "/jsonrpc", data=orjson.dumps(payload),
+            headers={"Content-Type": "application/json"}, timeout=60,
+        )
         r.raise_for_status()
-        data = r.json()
+        data = orjson.loads(r.content)
         if "error" in data:
-            raise RuntimeError(str(data["error"]))
+            raise OdooError(data["error"])
         return data.get("result")
 
-    def authenticate(self) -> int:
+    def authenticate(self, force: bool = False) -> int:
         if not self.db or not self.user or not self.password:
             raise RuntimeError("Faltan ODOO_DB/ODOO_USER/ODOO_PASSWORD")
-        self.uid = self._jsonrpc("common", "authenticate", self.db, self.user, self.password, {})
-        if not self.uid:
-            raise RuntimeError("Odoo authentication failed")
+        key = (self.url, self.db, self.user, self.password)
+        uid = None if force else _UID_CACHE.get(key)
+        if uid is None:
+            uid = self._jsonrpc("common", "authenticate", self.db, self.user, self.password, {})
+            if not uid:
+                raise RuntimeError("Odoo authentication failed")
+            _UID_CACHE[key] = uid
+        self.uid = uid
         return self.uid
 
     def execute_kw(self, model: str, method: str, args: list, kwargs: dict | None = None):
         if self.uid is None:
             self.authenticate()
-        return self._jsonrpc("object", "execute_kw", self.db, self.uid, self.password, model, method, args, kwargs or {})
+        try:
+            return self._jsonrpc("object", "execute_kw", self.db, self.uid, self.password, model, method, args, kwargs or {})
+        except OdooError as e:
+            if e.name != "odoo.exceptions.AccessDenied":
+                raise
+            # uid cacheado ya no válido: se reautentica una vez (Odoo rechaza antes de ejecutar nada)
+            self.authenticate(force=True)
+            return self._jsonrpc("object", "execute_kw", self.db, self.uid, self.password, model, method, args, kwargs or {})
+
+    def execute_many(self, calls: list[tuple]) -> list:
+        """
+        Ejecuta en paralelo llamadas execute_kw independientes.
+        Cada llamada es (model, method, args[, kwargs]); los resultados vuelven en el mismo orden.
+        La primera se ejecuta en el hilo que llama, que si no estaría parado esperando.
+        """
+        if not calls:
+            return []
+        if self.uid is None:
+            self.authenticate()
+        futures = [_RPC_POOL.submit(self.execute_kw, *c) for c in calls[1:]]
+        first = self.execute_kw(*calls[0])
+        return [first] + [f.result() for f in futures]
 
     # Helpers
     def search(self, model: str, domain: list, limit: int = 80, order: str | None = None):
@@ -99,7 +169,23 @@ class OdooClient:
         return self.execute_kw(model, "read_group", [domain, fields, groupby], kw)
 
 
+def get_odoo() -> OdooClient:
+    """
+    Dependencia FastAPI: cliente autenticado (uid cacheado y conexiones compartidas).
+    """
+    odoo = OdooClient()
+    odoo.authenticate()
+    return odoo
+
+
 # ---------- UTILIDADES ----------
+_WS_RE = re.compile(r"\s+")
+MAX_ATTACHMENT_MB = float(os.getenv("MAX_ATTACHMENT_MB") or 20)
+MAX_ATTACHMENT_BYTES = int(MAX_ATTACHMENT_MB * 1024 * 1024)
+# NIF propio normalizado (para excluir nuestra empresa de los candidatos)
+COMPANY_VAT = (os.getenv("COMPANY_VAT") or "").upper().replace(" ", "")
+
+
 def _normalize_b64(s: str) -> str:
     """
     Limpia cabeceras data:, elimina espacios y corrige padding para base64.
@@ -111,7 +197,7 @@ def _normalize_b64(s: str) -> str:
     if "," in s and ";base64" in s.split(",", 1)[0]:
         s = s.split(",", 1)[1]
     # quitar whitespace
-    s = re.sub(r"\s+", "", s)
+    s = _WS_RE.sub("", s)
     # padding
     missing = (-len(s)) % 4
     if missing:
@@ -119,70 +205,140 @@ def _normalize_b64(s: str) -> str:
     return s
 
 
+def _check_b64_size(b64: str) -> None:
+    """
+    Rechaza con 413 antes de decodificar: 4 caracteres base64 equivalen a 3 bytes.
+    """
+    if len(b64) // 4 * 3 > MAX_ATTACHMENT_BYTES:
+        raise HTTPException(status_code=413, detail=f"El archivo supera el límite de {MAX_ATTACHMENT_MB:g} MB.")
+
+
 # ---------- OCR / PARSER ----------
-def _extract_text_pdf(pdf_bytes: bytes) -> str:
+# Tesseract corre en un subproceso (sin GIL): las páginas se reconocen en paralelo.
+# Pool propio y acotado a las CPUs para no disparar procesos por cada petición concurrente.
+_OCR_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 2)
+OCR_DPI = int(os.getenv("OCR_DPI") or 200)
+
+
+def _ocr_page(img) -> str:
+    return pytesseract.image_to_string(img, lang="spa+eng")
+
+
+def _page_has_image(page) -> bool:
+    # solo mira si la página declara XObjects (imágenes escaneadas); no decodifica nada
+    try:
+        res = page.get("/Resources")
+        return res is not None and "/XObject" in res.get_object()
+    except Exception:
+        return True
+
+
+def _extract_text_pdf(pdf_bytes: bytes) -> tuple[list[str], Optional[list[int]]]:
+    """
+    Texto por página y los índices de las páginas a pasar por OCR: sin texto útil
+    (< 20 caracteres) y con imagen. Una página en blanco o solo con pie no se rasteriza.
+    Si el PDF no se puede leer devuelve ([], None) y se hace OCR completo.
+    """
     try:
         reader = PdfReader(io.BytesIO(pdf_bytes))
     except Exception:
-        return ""
-    out = []
-    for p in reader.pages:
+        return [], None
+    pages, missing = [], []
+    for i, p in enumerate(reader.pages):
         try:
             t = p.extract_text() or ""
         except Exception:
             t = ""
-        if t.strip():
-            out.append(t)
-    return "\n".join(out)
+        if len(t.strip()) < 20 and _page_has_image(p):
+            missing.append(i)
+        pages.append(t)
+    return pages, missing
 
 
 def _ocr_pdf(pdf_bytes: bytes) -> str:
-    images = convert_from_bytes(pdf_bytes, dpi=200, fmt="png")
-    parts = [pytesseract.image_to_string(img, lang="spa+eng") for img in images]
+    # gris y ppm (sin compresión): tesseract binariza igualmente y nos ahorramos codificar PNG
+    images = convert_from_bytes(
+        pdf_bytes, dpi=OCR_DPI, fmt="ppm", grayscale=True, thread_count=os.cpu_count() or 1,
+    )
+    parts = _OCR_POOL.map(_ocr_page, images)
     return "\n".join(parts)
 
 
+def _ocr_pdf_pages(pdf_bytes: bytes, page_indices: list[int]) -> dict[int, str]:
+    # cada convert_from_bytes copia el PDF a disco y lanza poppler: una llamada por tramo
+    # de páginas consecutivas, no por página (poppler numera desde 1)
+    runs: list[list[int]] = []
+    for i in sorted(page_indices):
+        if runs and i == runs[-1][-1] + 1:
+            runs[-1].append(i)
+        else:
+            runs.append([i])
+    images = []
+    for run in runs:
+        images += convert_from_bytes(
+            pdf_bytes, dpi=OCR_DPI, fmt="ppm", grayscale=True,
+            first_page=run[0] + 1, last_page=run[-1] + 1, thread_count=min(len(run), os.cpu_count() or 1),
+        )
+    texts = _OCR_POOL.map(_ocr_page, images)
+    return dict(zip((i for run in runs for i in run), texts))
+
+
 def _ocr_image(img_bytes: bytes) -> str:
     img = Image.open(io.BytesIO(img_bytes))
-    return pytesseract.image_to_string(img, lang="spa+eng")
+    return _ocr_page(img)
 
 
-def parse_invoice_content(filename: str, file_b64: str) -> dict:
-    raw = base64.b64decode(_normalize_b64(file_b64))
-    ext = (filename.rsplit(".", 1)[-1] if "." in filename else "").lower()
+# Patrones del parser, compilados una vez
+_RE_NUM = re.compile(r"-?\d+(?:\.\d+)?")
+_RE_REFS = [
+    re.compile(r"Factura\s*(?:N[ºo]|No|#)\s*([A-Za-z0-9\-\/\.]+)", re.IGNORECASE),
+    re.compile(r"N[ºo]\s*Factura\s*([A-Za-z0-9\-\/\.]+)", re.IGNORECASE),
+]
+_RE_TOTAL = re.compile(r"Total(?:\s*Factura)?\s*[:\-]?\s*([0-9\.\,]+)", re.IGNORECASE)
+_RE_BASE = re.compile(r"Base(?:\s*Imponible)?\s*[:\-]?\s*([0-9\.\,]+)", re.IGNORECASE)
+_RE_IVA = re.compile(r"(?:IVA|Impuesto)\s*(?:\d+%|\(.*?\))?\s*[:\-]?\s*([0-9\.\,]+)", re.IGNORECASE)
+_RE_VAT_LINE = re.compile(r"\b(CIF|NIF|VAT)\b", re.IGNORECASE)
+_RE_DESC_HDR = re.compile(r"(concepto|descripción|servicio|detalle)", re.IGNORECASE)
+
+
+def _parse_invoice_raw(raw: bytes, ext: str) -> dict:
     text = ""
     if ext == "pdf":
-        text = _extract_text_pdf(raw)
-        if len(text.strip()) < 20:
+        pages, missing = _extract_text_pdf(raw)
+        if missing is None or (pages and len(missing) == len(pages)):
+            # ilegible para pypdf o escaneado entero: una sola rasterización de todo el PDF
             text = _ocr_pdf(raw)
+        else:
+            # PDF mixto: OCR solo de las páginas sin texto, manteniendo el orden
+            if missing:
+                for i, t in _ocr_pdf_pages(raw, missing).items():
+                    pages[i] = t
+            text = "\n".join(t for t in pages if t.strip())
     else:
         text = _ocr_image(raw)
 
     def _num(s: str):
         s = s.replace(".", "").replace(",", ".")
-        m = re.findall(r"-?\d+(?:\.\d+)?", s)
+        m = _RE_NUM.findall(s)
         return float(m[0]) if m else None
 
     ref = None
-    for pat in [
-        r"Factura\s*(?:N[ºo]|No|#)\s*([A-Za-z0-9\-\/\.]+)",
-        r"N[ºo]\s*Factura\s*([A-Za-z0-9\-\/\.]+)",
-    ]:
-        m = re.search(pat, text, re.IGNORECASE)
+    for pat in _RE_REFS:
+        m = pat.search(text)
         if m:
             ref = m.group(1).strip()
             break
 
     tot = None
-    m = re.search(r"Total(?:\s*Factura)?\s*[:\-]?\s*([0-9\.\,]+)", text, re.IGNORECASE)
+    m = _RE_TOTAL.search(text)
     if m:
         tot = _num(m.group(1))
     base_imp = None
-    m = re.search(r"Base(?:\s*Imponible)?\s*[:\-]?\s*([0-9\.\,]+)", text, re.IGNORECASE)
+    m = _RE_BASE.search(text)
     if m:
         base_imp = _num(m.group(1))
     iva = None
-    m = re.search(r"(?:IVA|Impuesto)\s*(?:\d+%|\(.*?\))?\s*[:\-]?\s*([0-9\.\,]+)", text, re.IGNORECASE)
+    m = _RE_IVA.search(text)
     if m:
         iva = _num(m.group(1))
 
@@ -190,7 +346,7 @@ def parse_invoice_content(filename: str, file_b64: str) -> dict:
     vendor_hint = None
     lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
     for i, ln in enumerate(lines[:25]):
-        if re.search(r"\b(CIF|NIF|VAT)\b", ln, re.IGNORECASE):
+        if _RE_VAT_LINE.search(ln):
             for back in range(1, 3):
                 if i - back >= 0 and len(lines[i - back]) > 3:
                     vendor_hint = lines[i - back]
@@ -198,9 +354,8 @@ def parse_invoice_content(filename: str, file_b64: str) -> dict:
             break
 
     desc = ""
-    for ln in lines:
-        if re.search(r"(concepto|descripción|servicio|detalle)", ln, re.IGNORECASE):
-            idx = lines.index(ln)
+    for idx, ln in enumerate(lines):
+        if _RE_DESC_HDR.search(ln):
             desc = " ".join(lines[idx : idx + 5])[:240]
             break
     if not desc:
@@ -220,8 +375,44 @@ def parse_invoice_content(filename: str, file_b64: str) -> dict:
     }
 
 
+# Resultado del parser por contenido: reintentos con el mismo archivo no repiten el OCR
+_PARSE_CACHE: dict[tuple, dict] = {}
+# la expulsión itera el dict: sin lock, otro hilo puede vaciarlo o insertar a mitad
+_PARSE_CACHE_LOCK = threading.Lock()
+
+
+def parse_invoice_content(filename: str, file_b64: str) -> dict:
+    b64 = _normalize_b64(file_b64)
+    _check_b64_size(b64)
+    raw = pybase64.b64decode(b64)
+    ext = (filename.rsplit(".", 1)[-1] if "." in filename else "").lower()
+    key = (hashlib.blake2b(raw, digest_size=16).digest(), ext)
+    parsed = _PARSE_CACHE.get(key)
+    if parsed is None:
+        parsed = _parse_invoice_raw(raw, ext)
+        with _PARSE_CACHE_LOCK:
+            if len(_PARSE_CACHE) >= 256:
+                _PARSE_CACHE.pop(next(iter(_PARSE_CACHE), None), None)
+            _PARSE_CACHE[key] = parsed
+    return dict(parsed)
+
+
 # ---------- FASTAPI ----------
-app = FastAPI(title="Odoo Invoice Tools")
+def _warm_odoo_auth() -> None:
+    try:
+        OdooClient().authenticate()
+    except Exception as e:
+        logging.getLogger(__name__).warning("Odoo auth al arrancar falló (se reintentará en la primera petición): %s", e)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # calienta el uid cacheado sin bloquear el arranque si Odoo tarda
+    _RPC_POOL.submit(_warm_odoo_auth)
+    yield
+
+
+app = FastAPI(title="Odoo Invoice Tools", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 
 @app.get("/health")
@@ -233,12 +424,22 @@ def health():
 @app.get("/debug/odoo_auth")
 def debug_odoo_auth():
     try:
-        uid = OdooClient().authenticate()
+        uid = OdooClient().authenticate(force=True)
         return {"ok": True, "uid": uid}
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
 
+# Vacía las cachés en memoria (reiniciar el worker tiene el mismo efecto)
+@app.post("/admin/cache/clear")
+def admin_cache_clear(_=Depends(require_api_key)):
+    _UID_CACHE.clear()
+    _LOOKUP_CACHE.clear()
+    with _PARSE_CACHE_LOCK:
+        _PARSE_CACHE.clear()
+    return {"ok": True}
+
+
 # ---- MODELOS (request) ----
 class ParseReq(BaseModel):
     filename: str
@@ -310,6 +511,118 @@ class AttachReq(BaseModel):
     file_b64: str
 
 
+class BulkOp(BaseModel):
+    op: str
+    args: dict = {}
+
+
+# Todas las operaciones corren en el mismo hilo: se acota para que una petición no lo acapare
+BULK_MAX_OPS = 20
+
+
+class BulkReq(BaseModel):
+    ops: List[BulkOp] = Field(max_length=BULK_MAX_OPS)
+
+
+# ---------- RESOLUCIÓN EN ODOO ----------
+# Resoluciones código -> id (cuentas, impuestos, países, productos): cambian poco, se cachean con TTL
+LOOKUP_CACHE_TTL = float(os.getenv("LOOKUP_CACHE_TTL") or 300)
+_LOOKUP_CACHE: dict[tuple, tuple[float, int]] = {}
+
+
+def _cache_get(key: tuple) -> Optional[int]:
+    hit = _LOOKUP_CACHE.get(key)
+    if hit and hit[0] > time.monotonic():
+        return hit[1]
+    return None
+
+
+def _cache_put(key: tuple, value: int) -> None:
+    if len(_LOOKUP_CACHE) >= 1024:
+        _LOOKUP_CACHE.clear()
+    _LOOKUP_CACHE[key] = (time.monotonic() + LOOKUP_CACHE_TTL, value)
+
+
+def _resolve_account_id(odoo: OdooClient, code: str, company_id: Optional[int] = None) -> Optional[int]:
+    key = (company_id, "account", code)
+    acc_id = _cache_get(key)
+    if acc_id is None:
+        dom = [["code", "=", code]]
+        if company_id:
+            dom.append(["company_id", "=", company_id])
+        ids = odoo.search("account.account", dom, limit=1)
+        if ids:
+            acc_id = ids[0]
+            _cache_put(key, acc_id)
+    return acc_id
+
+
+def _resolve_country_id(odoo: OdooClient, code: str) -> Optional[int]:
+    key = (None, "country", code)
+    cid = _cache_get(key)
+    if cid is None:
+        ids = odoo.search("res.country", [["code", "=", code]], limit=1)
+        if ids:
+            cid = ids[0]
+            _cache_put(key, cid)
+    return cid
+
+
+def _resolve_product_id(odoo: OdooClient, name: Optional[str], company_id: Optional[int]) -> Optional[int]:
+    # product "Sin producto"
+    if not name:
+        return None
+    key = (company_id, "product", name)
+    prod = _cache_get(key)
+    if prod is None:
+        dom = [["name", "=", name]]
+        if company_id:
+            dom.append(["company_id", "in", [company_id, False]])
+        pids = odoo.search("product.product", dom, limit=1)
+        if pids:
+            prod = pids[0]
+            _cache_put(key, prod)
+    return prod
+
+
+def _resolve_tax_ids(odoo: OdooClient, codes: list[str], names: list[str], company_id: Optional[int]) -> list[int]:
+    """
+    Busca impuestos de compra por código (description exacta) y por nombre (ilike).
+    Lo que no está en caché se pide en una sola búsqueda con OR; para cada entrada
+    gana el primero en el orden de Odoo (sequence, id), igual que un search con limit=1.
+    """
+    keys = [(company_id, "tax_code", c) for c in codes] + [(company_id, "tax_name", n) for n in names]
+    found = {k: _cache_get(k) for k in keys}
+    todo = [k for k, v in found.items() if v is None]
+    if todo:
+        todo_codes = [k[2] for k in todo if k[1] == "tax_code"]
+        atoms = [["description", "in", todo_codes]] if todo_codes else []
+        atoms += [["name", "ilike", k[2]] for k in todo if k[1] == "tax_name"]
+        dom = [["type_tax_use", "in", ["purchase", "none"]]]
+        if company_id:
+            dom.append(["company_id", "=", company_id])
+        dom += ["|"] * (len(atoms) - 1) + atoms
+        rows = odoo.execute_kw("account.tax", "search_read", [dom], {"fields": ["name", "description"], "order": "sequence, id"})
+        for k in todo:
+            if k[1] == "tax_code":
+                hit = next((r["id"] for r in rows if r.get("description") == k[2]), None)
+            else:
+                needle = k[2].lower()
+                hit = next((r["id"] for r in rows if needle in (r.get("name") or "").lower()), None)
+            if hit:
+                found[k] = hit
+                _cache_put(k, hit)
+
+    # sin duplicados y en el orden pedido (código y nombre pueden dar el mismo impuesto)
+    seen, tax_ids = set(), []
+    for k in keys:
+        tid = found[k]
+        if tid and tid not in seen:
+            seen.add(tid)
+            tax_ids.append(tid)
+    return tax_ids
+
+
 # ---------- ENDPOINTS / TOOLS ----------
 @app.post("/tools/parse_invoice")
 def t_parse(body: ParseReq, _=Depends(require_api_key)):
@@ -317,37 +630,41 @@ def t_parse(body: ParseReq, _=Depends(require_api_key)):
 
 
 @app.post("/tools/check_partner_existence")
-def t_check_partner(body: PartnerExistReq, _=Depends(require_api_key)):
-    my_vat = (os.getenv("COMPANY_VAT") or "").upper().replace(" ", "")
-    odoo = OdooClient(); odoo.authenticate()
+def t_check_partner(body: PartnerExistReq, _=Depends(require_api_key), odoo: OdooClient = Depends(get_odoo)):
     cand = []
 
-    # VAT exacto
+    # VAT exacto y nombre aproximado son independientes: se piden en una sola ida y vuelta
+    calls = []
     if body.vat:
-        ids = odoo.search("res.partner", [["vat", "=", body.vat]], limit=10)
-        if ids:
-            recs = odoo.read("res.partner", ids, ["name", "vat", "supplier_rank"])
-            for r in recs:
-                v = (r.get("vat") or "").upper().replace(" ", "")
-                if v == my_vat:
-                    continue
-                cand.append({"id": r["id"], "name": r["name"], "vat": r.get("vat"), "score": 1.0})
-
-    # Nombre aproximado
+        calls.append(("res.partner", "search_read", [[["vat", "=", body.vat]]],
+                      {"fields": ["name", "vat"], "limit": 10}))
     if body.name:
         domain = [["supplier_rank", ">", 0], ["active", "=", True], ["name", "ilike", body.name]]
-        recs = odoo.search_read("res.partner", domain, ["name", "vat"], limit=50)
-        from difflib import SequenceMatcher
-        for r in recs:
+        calls.append(("res.partner", "search_read", [domain], {"fields": ["name", "vat"], "limit": 50}))
+    results = iter(odoo.execute_many(calls))
+    vat_recs = next(results) if body.vat else []
+    name_recs = next(results) if body.name else []
+
+    # VAT exacto
+    for r in vat_recs:
+        v = (r.get("vat") or "").upper().replace(" ", "")
+        if v == COMPANY_VAT:
+            continue
+        cand.append({"id": r["id"], "name": r["name"], "vat": r.get("vat"), "score": 1.0})
+
+    # Nombre aproximado
+    if name_recs:
+        needle = body.name.lower()
+        for r in name_recs:
             v = (r.get("vat") or "").upper().replace(" ", "")
-            if v == my_vat:
+            if v == COMPANY_VAT:
                 continue
-            sc = SequenceMatcher(None, body.name.lower(), (r["name"] or "").lower()).ratio()
+            sc = fuzz.ratio(needle, (r["name"] or "").lower()) / 100
             cand.append({"id": r["id"], "name": r["name"], "vat": r.get("vat"), "score": round(sc, 3)})
 
     # Ranking por uso (sin orderby en Odoo; ordenamos en Python)
     if cand:
-        ids = [c["id"] for c in cand]
+        ids = list({c["id"] for c in cand})
         rg = odoo.read_group(
             "account.move",
             [["move_type", "in", ["in_invoice", "in_refund"]], ["partner_id", "in", ids]],
@@ -361,13 +678,13 @@ def t_check_partner(body: PartnerExistReq, _=Depends(require_api_key)):
         for c in cand:
             c["usage"] = usage.get(c["id"], 0)
 
-    cand = sorted(cand, key=lambda x: (x.get("score", 0), x.get("usage", 0)), reverse=True)
+    # todos los candidatos llevan score y usage
+    cand.sort(key=itemgetter("score", "usage"), reverse=True)
     return {"candidates": cand}
 
 
 @app.post("/tools/supplier_usage_rank")
-def t_usage(body: SupplierUsageReq, _=Depends(require_api_key)):
-    odoo = OdooClient(); odoo.authenticate()
+def t_usage(body: SupplierUsageReq, _=Depends(require_api_key), odoo: OdooClient = Depends(get_odoo)):
     rg = odoo.read_group(
         "account.move",
         [["move_type", "in", ["in_invoice", "in_refund"]], ["partner_id", "in", body.partner_ids]],
@@ -382,8 +699,7 @@ def t_usage(body: SupplierUsageReq, _=Depends(require_api_key)):
 
 
 @app.post("/tools/create_supplier_partner")
-def t_create_partner(body: CreateSupplierReq, _=Depends(require_api_key)):
-    odoo = OdooClient(); odoo.authenticate()
+def t_create_partner(body: CreateSupplierReq, _=Depends(require_api_key), odoo: OdooClient = Depends(get_odoo)):
     vals = {
         "name": body.name,
         "supplier_rank": 1,
@@ -394,58 +710,34 @@ def t_create_partner(body: CreateSupplierReq, _=Depends(require_api_key)):
         if v:
             vals[k] = v
     if body.country_code:
-        cid = odoo.search("res.country", [["code", "=", body.country_code]], limit=1)
+        cid = _resolve_country_id(odoo, body.country_code)
         if cid:
-            vals["country_id"] = cid[0]
+            vals["country_id"] = cid
     pid = odoo.create("res.partner", vals)
     return {"partner_id": pid}
 
 
 @app.post("/tools/resolve_account")
-def t_resolve_account(body: ResolveAccountReq, _=Depends(require_api_key)):
-    odoo = OdooClient(); odoo.authenticate()
-    dom = [["code", "=", body.account_code]]
-    if body.company_id:
-        dom.append(["company_id", "=", body.company_id])
-    ids = odoo.search("account.account", dom, limit=1)
-    return {"account_id": ids[0]} if ids else {"account_id": None}
+def t_resolve_account(body: ResolveAccountReq, _=Depends(require_api_key), odoo: OdooClient = Depends(get_odoo)):
+    return {"account_id": _resolve_account_id(odoo, body.account_code, body.company_id)}
 
 
 @app.post("/tools/resolve_taxes")
-def t_resolve_taxes(body: ResolveTaxesReq, _=Depends(require_api_key)):
-    odoo = OdooClient(); odoo.authenticate()
-    tax_ids = []
-    for code in (body.codes or []):
-        dom = [["type_tax_use", "in", ["purchase", "none"]], ["description", "=", code]]
-        if body.company_id:
-            dom.append(["company_id", "=", body.company_id])
-        ids = odoo.search("account.tax", dom, limit=1)
-        if ids:
-            tax_ids += ids
-    for name in (body.names or []):
-        dom = [["type_tax_use", "in", ["purchase", "none"]], ["name", "ilike", name]]
-        if body.company_id:
-            dom.append(["company_id", "=", body.company_id])
-        ids = odoo.search("account.tax", dom, limit=1)
-        if ids:
-            tax_ids += ids
-    tax_ids = list(dict.fromkeys(tax_ids))
+def t_resolve_taxes(body: ResolveTaxesReq, _=Depends(require_api_key), odoo: OdooClient = Depends(get_odoo)):
+    tax_ids = _resolve_tax_ids(odoo, body.codes or [], body.names or [], body.company_id)
     return {"tax_ids": tax_ids}
 
 
 @app.post("/tools/check_duplicate")
-def t_check_dup(body: CheckDupReq, _=Depends(require_api_key)):
-    odoo = OdooClient(); odoo.authenticate()
-    dom = [["move_type", "=", "in_invoice"], ["partner_id", "=", body.partner_id], ["ref", "=", body.ref]]
-    ids = odoo.search("account.move", dom, limit=1)
+def t_check_dup(body: CheckDupReq, _=Depends(require_api_key), odoo: OdooClient = Depends(get_odoo)):
+    # por ref y por importe se consultan a la vez: una sola ida y vuelta
+    base = [["move_type", "=", "in_invoice"], ["partner_id", "=", body.partner_id]]
+    ids, near = odoo.execute_many([
+        ("account.move", "search", [base + [["ref", "=", body.ref]]], {"limit": 1}),
+        ("account.move", "search_read", [base], {"fields": ["amount_total"], "limit": 50}),
+    ])
     if ids:
         return {"exists": True, "move_id": ids[0], "reason": "partner+ref"}
-    near = odoo.search_read(
-        "account.move",
-        [["move_type", "=", "in_invoice"], ["partner_id", "=", body.partner_id]],
-        ["id", "amount_total"],
-        limit=50,
-    )
     for r in near:
         if abs((r.get("amount_total") or 0.0) - body.total) <= body.tolerance * max(1.0, body.total):
             return {"exists": True, "move_id": r["id"], "reason": "amount_total ~"}
@@ -453,39 +745,21 @@ def t_check_dup(body: CheckDupReq, _=Depends(require_api_key)):
 
 
 @app.post("/tools/create_vendor_bill")
-def t_create_bill(body: CreateBillReq, _=Depends(require_api_key)):
-    odoo = OdooClient(); odoo.authenticate()
-    acc = odoo.search("account.account", [["code", "=", body.line.account_code]], limit=1)
-    if not acc:
+def t_create_bill(body: CreateBillReq, _=Depends(require_api_key), odoo: OdooClient = Depends(get_odoo)):
+    # cuenta, impuestos y producto son independientes: se resuelven en paralelo
+    # (la cuenta en este mismo hilo)
+    tax_f = _RPC_POOL.submit(_resolve_tax_ids, odoo, body.line.tax_codes or [], body.line.tax_names or [], body.company_id)
+    prod_f = _RPC_POOL.submit(_resolve_product_id, odoo, body.line.product_name, body.company_id)
+    acc_id = _resolve_account_id(odoo, body.line.account_code)
+    if not acc_id:
         raise HTTPException(400, detail=f"Cuenta {body.line.account_code} no existe")
-    tax_ids = []
-    for code in (body.line.tax_codes or []):
-        dom = [["type_tax_use", "in", ["purchase", "none"]], ["description", "=", code]]
-        if body.company_id:
-            dom.append(["company_id", "=", body.company_id])
-        ids = odoo.search("account.tax", dom, limit=1)
-        tax_ids += ids
-    for name in (body.line.tax_names or []):
-        dom = [["type_tax_use", "in", ["purchase", "none"]], ["name", "ilike", name]]
-        if body.company_id:
-            dom.append(["company_id", "=", body.company_id])
-        ids = odoo.search("account.tax", dom, limit=1)
-        tax_ids += ids
-    tax_ids = list(dict.fromkeys(tax_ids))
-    # product "Sin producto"
-    prod = None
-    if body.line.product_name:
-        dom = [["name", "=", body.line.product_name]]
-        if body.company_id:
-            dom.append(["company_id", "in", [body.company_id, False]])
-        pids = odoo.search("product.product", dom, limit=1)
-        if pids:
-            prod = pids[0]
+    tax_ids = tax_f.result()
+    prod = prod_f.result()
     line_vals = {
         "name": body.line.name,
         "quantity": body.line.quantity,
         "price_unit": body.line.price_unit,
-        "account_id": acc[0],
+        "account_id": acc_id,
     }
     if prod:
         line_vals["product_id"] = prod
@@ -505,25 +779,42 @@ def t_create_bill(body: CreateBillReq, _=Depends(require_api_key)):
     return {"move_id": move_id}
 
 
+def _post_attachment_message(odoo: OdooClient, move_id: int, att_id: int) -> None:
+    # enlaza en el chatter sin reenviar el binario
+    try:
+        odoo.execute_kw(
+            "account.move", "message_post",
+            [[move_id]],
+            {"body": "Archivo adjuntado desde API", "attachment_ids": [(4, att_id)]}
+        )
+    except Exception:
+        # no es crítico; el archivo ya está adjunto al registro
+        pass
+
+
 @app.post("/tools/attach_file")
-def t_attach(body: AttachReq, _=Depends(require_api_key)):
+def t_attach(
+    body: AttachReq, background: BackgroundTasks,
+    _=Depends(require_api_key), odoo: OdooClient = Depends(get_odoo),
+):
     """
     Adjunta archivo correctamente:
     1) Normaliza y valida base64 -> bytes
     2) Crea ir.attachment (datas = base64)
-    3) Lo enlaza al movimiento con message_post(attachment_ids)
+    3) Lo enlaza al movimiento con message_post(attachment_ids), tras responder
     """
-    odoo = OdooClient(); odoo.authenticate()
-
     # 1) normaliza y valida
     b64 = _normalize_b64(body.file_b64)
+    _check_b64_size(b64)
     try:
-        raw = base64.b64decode(b64, validate=True)
+        raw = pybase64.b64decode(b64, validate=True)
     except Exception:
         raise HTTPException(status_code=422, detail="El contenido enviado no es base64 válido.")
     # si es PDF, comprobamos cabecera
-    if body.filename.lower().endswith(".pdf") and not raw.startswith(b"%PDF-"):
+    is_pdf = body.filename.lower().endswith(".pdf")
+    if is_pdf and not raw.startswith(b"%PDF-"):
         raise HTTPException(status_code=422, detail="El contenido no parece un PDF válido (cabecera %PDF- ausente).")
+    del raw  # a Odoo se envía el base64; los bytes solo servían para validar
 
     # 2) crea el adjunto
     vals = {
@@ -532,24 +823,96 @@ def t_attach(body: AttachReq, _=Depends(require_api_key)):
         "res_id": body.move_id,
         "type": "binary",
         "datas": b64,  # Odoo espera base64 aquí
-        "mimetype": "application/pdf" if body.filename.lower().endswith(".pdf") else "application/octet-stream",
+        "mimetype": "application/pdf" if is_pdf else "application/octet-stream",
     }
     att_id = odoo.create("ir.attachment", vals)
 
-    # 3) enlaza en el chatter sin reenviar el binario
-    try:
-        odoo.execute_kw(
-            "account.move", "message_post",
-            [[body.move_id]],
-            {"body": "Archivo adjuntado desde API", "attachment_ids": [(4, att_id)]}
-        )
-    except Exception:
-        # no es crítico; el archivo ya está adjunto al registro
-        pass
+    # 3) el mensaje en el chatter no es crítico: se publica después de responder
+    background.add_task(_post_attachment_message, odoo, body.move_id, att_id)
 
     return {"ok": True, "attachment_id": att_id}
 
 
+# ---------- BULK ----------
+# op -> (modelo de entrada, ejecución con el cliente y las tareas de fondo de la petición)
+_BULK_OPS = {
+    "parse_invoice": (ParseReq, lambda b, odoo, bg: t_parse(b, None)),
+    "check_partner_existence": (PartnerExistReq, lambda b, odoo, bg: t_check_partner(b, None, odoo)),
+    "supplier_usage_rank": (SupplierUsageReq, lambda b, odoo, bg: t_usage(b, None, odoo)),
+    "create_supplier_partner": (CreateSupplierReq, lambda b, odoo, bg: t_create_partner(b, None, odoo)),
+    "resolve_account": (ResolveAccountReq, lambda b, odoo, bg: t_resolve_account(b, None, odoo)),
+    "resolve_taxes": (ResolveTaxesReq, lambda b, odoo, bg: t_resolve_taxes(b, None, odoo)),
+    "check_duplicate": (CheckDupReq, lambda b, odoo, bg: t_check_dup(b, None, odoo)),
+    "create_vendor_bill": (CreateBillReq, lambda b, odoo, bg: t_create_bill(b, None, odoo)),
+    "attach_file": (AttachReq, lambda b, odoo, bg: t_attach(b, bg, None, odoo)),
+}
+
+
+class BulkError(Exception):
+    """Error de la propia petición bulk (operación desconocida, $ref no válida)."""
+
+
+def _bulk_resolve(value: Any, results: list) -> Any:
+    """
+    Sustituye {"$ref": "$<n>.<campo>[.<campo>...]"} por el valor del resultado n-ésimo.
+    """
+    if isinstance(value, dict):
+        if set(value) == {"$ref"}:
+            head, *path = str(value["$ref"]).lstrip("$").split(".")
+            try:
+                cur = results[int(head)]
+                for part in path:
+                    cur = cur[int(part)] if isinstance(cur, list) else cur[part]
+            except (ValueError, IndexError, KeyError, TypeError):
+                raise BulkError(f"Referencia no válida: {value['$ref']}")
+            return cur
+        return {k: _bulk_resolve(v, results) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_bulk_resolve(v, results) for v in value]
+    return value
+
+
+@app.post("/tools/bulk")
+def t_bulk(
+    body: BulkReq, background: BackgroundTasks,
+    _=Depends(require_api_key), odoo: OdooClient = Depends(get_odoo),
+):
+    """
+    Ejecuta varias herramientas en orden dentro de una sola petición.
+    Los args pueden usar resultados anteriores con {"$ref": "$0.partner_id"}.
+    Al primer error se detiene: el resto de operaciones quedan como "skipped".
+    """
+    results, out, failed = [], [], False
+    for op in body.ops:
+        if failed:
+            out.append({"op": op.op, "status": "skipped"})
+            continue
+        try:
+            if op.op not in _BULK_OPS:
+                raise BulkError(f"Operación desconocida: {op.op}")
+            model, run = _BULK_OPS[op.op]
+            res = run(model(**_bulk_resolve(op.args, results)), odoo, background)
+        except HTTPException as e:
+            detail = e.detail
+        except ValidationError as e:
+            # mismo formato que el 422 de FastAPI, sin el input ni la URL de la doc
+            detail = e.errors(include_url=False, include_input=False, include_context=False)
+        except BulkError as e:
+            detail = str(e)
+        except OdooError as e:
+            detail = e.message
+        except Exception:
+            logging.getLogger(__name__).exception("bulk: fallo en %s", op.op)
+            detail = "error interno"
+        else:
+            results.append(res)
+            out.append({"op": op.op, "status": "ok", "result": res})
+            continue
+        failed = True
+        out.append({"op": op.op, "status": "error", "detail": detail})
+    return {"results": out}
+
+
 # ---------- ROOT & HEAD ----------
 @app.get("/", include_in_schema=False)
 def root():
@@ -561,7 +924,8 @@ def root():
         "tools": ["/tools/parse_invoice", "/tools/check_partner_existence",
                   "/tools/supplier_usage_rank", "/tools/create_supplier_partner",
                   "/tools/resolve_account", "/tools/resolve_taxes",
-                  "/tools/check_duplicate", "/tools/create_vendor_bill", "/tools/attach_file"]
+                  "/tools/check_duplicate", "/tools/create_vendor_bill", "/tools/attach_file",
+                  "/tools/bulk"]
     })
 
 